@@ -1,16 +1,19 @@
 # app.py
-from fastapi import FastAPI, Request, Form
+from fastapi import FastAPI, Request, Form, BackgroundTasks
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
+import asyncio
 import subprocess
 import os
 import json
-import shutil
+import threading
+from utils.sync_repo import sync_repo
+from utils.atomic_write import atomic_write
 from utils.detect_app_type import detect_app_type
-from utils.generate_docker_file import  generate_dockerfile
-from utils.build_docker_image import build_docker_image
-from utils.deploy_to_kub import deploy_to_k8s
+from utils.generate_docker_file import  generate_dockerfile, write_cached_dockerfile
+from utils.build_docker_image import build_docker_image, warm_base_images
+from utils.deploy_to_kub import deploy_to_k8s, prepare_cluster
 
 
 app = FastAPI()
@@ -21,65 +24,169 @@ DATA_FILE = "apps.json"
 CLONE_DIR = "deployments"
 os.makedirs(CLONE_DIR, exist_ok=True)
 
-# load apps
+# Base images most generated Dockerfiles start FROM, pulled at startup
+WARM_IMAGES = [
+    image.strip()
+    for image in os.environ.get("KUBEHOST_WARM_IMAGES", "python:3.12-slim,node:20-alpine,nginx:alpine").split(",")
+    if image.strip()
+]
+
+# Pipeline stages an app moves through; only one pipeline per app at a time
+ACTIVE_STATUSES = ("queued", "cloning", "building", "deploying")
+MAX_CONCURRENT_BUILDS = int(os.environ.get("KUBEHOST_MAX_BUILDS", "2"))
+build_slots = asyncio.Semaphore(MAX_CONCURRENT_BUILDS)
+
+# load apps, indexed by appName (stored on disk as a list)
+apps_data: dict[str, dict] = {}
 if os.path.exists(DATA_FILE) and os.path.getsize(DATA_FILE) > 0:
     with open(DATA_FILE, "r") as f:
-        apps_data = json.load(f)
-else:
-    apps_data = []
+        apps_data = {a["appName"]: a for a in json.load(f)}
+
+# Pipelines don't survive a restart
+for app_info in apps_data.values():
+    if app_info.get("status") in ACTIVE_STATUSES:
+        app_info["status"] = "error"
+        app_info["message"] = "Interrupted by server restart"
+
+_apps_lock = asyncio.Lock()
+
+async def persist_apps():
+    """Write the current apps_data off the event loop, one write at a time"""
+    # Serialize on the event loop, where set_status mutates the records, so
+    # the worker thread only ever sees a finished string. Holding the lock
+    # means an older state can never land after a newer one
+    async with _apps_lock:
+        text = json.dumps(list(apps_data.values()))
+        await asyncio.to_thread(atomic_write, DATA_FILE, text)
+
+def save_apps(background_tasks: BackgroundTasks):
+    """Persist apps_data after the response has been sent"""
+    background_tasks.add_task(persist_apps)
 
-def save_apps():
-    with open(DATA_FILE, "w") as f:
-        json.dump(apps_data, f, indent=2)
+async def set_status(app_info, status, **fields):
+    app_info["status"] = status
+    app_info.update(fields)
+    print(f"[{app_info['appName']}] {status}")
+    await persist_apps()
 
 
 
+def report_warm_failure(task):
+    """Log an unexpected warm-up error now instead of when the task is collected"""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Warning: Pre-pulling base images failed: {task.exception()}")
+
+@app.on_event("startup")
+async def warm_bases():
+    # Fire and forget so the first deploy doesn't pay for the pulls and
+    # startup isn't blocked on them
+    app.state.warm_task = asyncio.create_task(warm_base_images(WARM_IMAGES))
+    app.state.warm_task.add_done_callback(report_warm_failure)
+
 @app.get("/", response_class=HTMLResponse)
 def home(request: Request):
-    return templates.TemplateResponse("index.html", {"request": request, "apps": apps_data})
+    return templates.TemplateResponse("index.html", {"request": request, "apps": list(apps_data.values())})
 
-@app.post("/deploy")
-def deploy(request: Request, gitUrl: str = Form(...), branch: str = Form("main"), appName: str = Form(...), envVars: str = Form("")):
-    app_path = os.path.join(CLONE_DIR, appName)
-    if os.path.exists(app_path):
-        shutil.rmtree(app_path)
+@app.get("/api/status")
+def api_status():
+    return [
+        {
+            "appName": a["appName"],
+            "status": a["status"],
+            "url": a.get("url"),
+            "message": a.get("message"),
+        }
+        for a in apps_data.values()
+    ]
 
-    try:
-        subprocess.run(["git", "clone", "-b", branch, gitUrl, app_path], check=True)
-        app_type = detect_app_type(app_path)
+async def build_app(app_info, app_path):
+    """Fetch the source and build its image; returns (app_type, image_tag, port)"""
+    appName = app_info["appName"]
+    envVars = app_info["envVars"]
+
+    await set_status(app_info, "cloning")
+    await sync_repo(app_info["gitUrl"], app_info["branch"], app_path)
+    app_type = detect_app_type(app_path)
+
+    # Create .env file if environment variables are provided
+    if envVars.strip():
+        env_file_path = os.path.join(app_path, ".env")
+        with open(env_file_path, "w") as env_file:
+            env_file.write(envVars.strip())
 
-        # Create .env file if environment variables are provided
-        if envVars.strip():
-            env_file_path = os.path.join(app_path, ".env")
-            with open(env_file_path, "w") as env_file:
-                env_file.write(envVars.strip())
+    await set_status(app_info, "building", type=app_type)
+    dockerfile_content, port, cache_path = await generate_dockerfile(app_path, app_type)
+    # Cap concurrent docker builds; they are CPU/disk heavy
+    async with build_slots:
+        cancel = threading.Event()
+        build = asyncio.ensure_future(asyncio.to_thread(build_docker_image, appName, app_path, cancel))
+        try:
+            image_tag = await asyncio.shield(build)
+        except asyncio.CancelledError:
+            # Cancelling can't stop the thread, so kill docker build and keep
+            # the slot (and the caller's error status) until it has returned
+            cancel.set()
+            await asyncio.gather(build, return_exceptions=True)
+            raise
+    # Only a Dockerfile that actually built is worth reusing
+    if cache_path:
+        write_cached_dockerfile(cache_path, dockerfile_content)
+    return app_type, image_tag, port
+
+async def run_pipeline(app_info):
+    """Clone, build and deploy an app, recording progress in its status field"""
+    appName = app_info["appName"]
+    app_path = os.path.join(CLONE_DIR, appName)
 
-        generate_dockerfile(app_path, app_type)
-        image_tag = build_docker_image(appName, app_path)
+    try:
+        # Getting Minikube and the ingress controller ready doesn't depend on
+        # the source, so overlap it with the clone, LLM call and image build
+        build = asyncio.create_task(build_app(app_info, app_path))
+        cluster = asyncio.create_task(asyncio.to_thread(prepare_cluster))
+        try:
+            (app_type, image_tag, port), _ = await asyncio.gather(build, cluster)
+        except BaseException:
+            # Stop the other half before the error status is recorded, so a
+            # still-running build can't move the app back to "building"
+            build.cancel()
+            cluster.cancel()
+            await asyncio.gather(build, cluster, return_exceptions=True)
+            raise
         
+        await set_status(app_info, "deploying")
         # Pass app_path and envVars to deployment function for port detection and env var injection
-        deployed_url = deploy_to_k8s(appName, image_tag, app_type, app_path=app_path, env_vars=envVars)
-
-        app_info = {
-            "appName": appName,
-            "gitUrl": gitUrl,
-            "branch": branch,
-            "type": app_type,
-            "status": "deployed",
-            "url": deployed_url,
-            "envVars": envVars
-        }
-        apps_data.append(app_info)
-        with open(DATA_FILE, "w") as f:
-            json.dump(apps_data, f, indent=2)
+        deployed_url = await asyncio.to_thread(
+            deploy_to_k8s, appName, image_tag, app_type, app_path=app_path, env_vars=app_info["envVars"], port=port
+        )
+        await set_status(app_info, "ready", url=deployed_url)
 
     except subprocess.CalledProcessError as e:
         error_msg = f"Deployment failed: {e.stderr if hasattr(e, 'stderr') and e.stderr else str(e)}"
         print(f"ERROR: {error_msg}")
-        return {"status": "error", "message": error_msg}
+        await set_status(app_info, "error", message=error_msg)
     except Exception as e:
         error_msg = f"Deployment error: {str(e)}"
         print(f"ERROR: {error_msg}")
-        return {"status": "error", "message": error_msg}
+        await set_status(app_info, "error", message=error_msg)
+
+@app.post("/deploy")
+async def deploy(request: Request, background_tasks: BackgroundTasks, gitUrl: str = Form(...), branch: str = Form("main"), appName: str = Form(...), envVars: str = Form("")):
+    existing = apps_data.get(appName)
+    if existing and existing.get("status") in ACTIVE_STATUSES:
+        return {"status": "error", "message": f"A deployment of {appName} is already in progress"}
+
+    # Respond straight away; the pipeline runs after the redirect is sent
+    app_info = {
+        "appName": appName,
+        "gitUrl": gitUrl,
+        "branch": branch,
+        "type": existing.get("type") if existing else None,
+        "status": "queued",
+        "url": existing.get("url") if existing else None,
+        "envVars": envVars
+    }
+    apps_data[appName] = app_info
+    save_apps(background_tasks)
+    background_tasks.add_task(run_pipeline, app_info)
 
     return RedirectResponse(url="/", status_code=303)
@@ -0,0 +1,13 @@
+import os
+import tempfile
+
+def atomic_write(path, text):
+    """Replace path with text so readers never see a half-written file"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
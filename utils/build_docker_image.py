@@ -1,9 +1,170 @@
+import asyncio
 import subprocess
 import os
 import re
+import hashlib
+import threading
+import time
+from collections import deque
+
+# PowerShell `minikube docker-env` line: VAR = "value" or VAR="value"
+_ENV_LINE_RE = re.compile(r'^(\w+)\s*=\s*["\']?([^"\']+)["\']?')
+_PS_ENV_PREFIX = '$Env:'
+_EXPOSE = re.compile(r'EXPOSE\s+(\d+)', re.IGNORECASE)
+
+BUILD_LOG_TAIL = 200  # Lines of build output kept for error messages
+CANCEL_POLL_INTERVAL = 0.5  # Seconds between checks for a timed-out or cancelled build
+# Older content tags kept per app besides the current one, so the revision a
+# rollout is replacing stays available until its pods are gone
+PREVIOUS_REVISIONS_KEPT = 1
+MINIKUBE_CHECK_TTL = 300  # Seconds to trust a running Minikube and its docker-env
+
+# Positive results are cached so back-to-back builds and deploys don't re-run
+# minikube; this is the only copy of that state, deploy_to_kub imports it
+_minikube_ok_until = 0.0
+_minikube_docker_env = None
+
+def exposed_port(dockerfile_content):
+    """Port from the first EXPOSE directive in a Dockerfile, or None"""
+    match = _EXPOSE.search(dockerfile_content)
+    return int(match.group(1)) if match else None
+
+def buildkit_env(base_env=None):
+    """Return a copy of the environment with BuildKit enabled"""
+    env = dict(base_env if base_env is not None else os.environ)
+    env["DOCKER_BUILDKIT"] = "1"
+    return env
+
+def docker_build_command(image_tag, app_path, extra_tags=()):
+    """Build command that reuses unchanged layers from the previous image.
+
+    There is no registry to export a cache to, so the cache lives inline in
+    the last image built under the same tag. Generated Dockerfiles copy the
+    dependency manifest before the source so that layer survives code edits.
+    """
+    command = [
+        "docker", "build",
+        "--build-arg", "BUILDKIT_INLINE_CACHE=1",
+        "--cache-from", image_tag,
+        "-t", image_tag,
+    ]
+    for tag in extra_tags:
+        command += ["-t", tag]
+    return command + [app_path]
+
+def compute_content_hash(app_path):
+    """Short hash of everything that ends up in the image.
+
+    HEAD covers every tracked file (lockfiles included); the generated
+    Dockerfile and .env are untracked so they are hashed directly.
+    """
+    head = subprocess.run(
+        ["git", "-C", app_path, "rev-parse", "HEAD"],
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+    digest = hashlib.sha256(head.encode())
+    for name in ("Dockerfile", ".env"):
+        path = os.path.join(app_path, name)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                digest.update(b"\0" + name.encode() + b"\0" + f.read())
+    return digest.hexdigest()[:12]
+
+def image_id(image_tag, env=None):
+    """Image ID of image_tag in the Docker daemon selected by env, or None if absent"""
+    result = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", image_tag],
+        capture_output=True, text=True, env=env
+    )
+    return result.stdout.strip() if result.returncode == 0 else None
+
+def image_exists(image_tag, env=None):
+    """Check whether image_tag is present in the Docker daemon selected by env"""
+    return image_id(image_tag, env=env) is not None
+
+def remove_stale_images(app_name, current_tag, env=None):
+    """
+    Untag an app's old content-addressed images in the daemon selected by env
+
+    Every code change adds a gitdeploy/<app>:<hash> tag, and tagged images
+    never become dangling, so without this each revision ever deployed stays
+    on Minikube's disk. :latest, current_tag and the newest
+    PREVIOUS_REVISIONS_KEPT other tags are kept.
+    """
+    repository = f"gitdeploy/{app_name}"
+    result = subprocess.run(
+        ["docker", "images", repository, "--format", "{{.Repository}}:{{.Tag}}"],
+        capture_output=True, text=True, env=env
+    )
+    if result.returncode != 0:
+        return
+    # docker images lists newest first
+    stale = [
+        tag for tag in result.stdout.split()
+        if tag not in (f"{repository}:latest", current_tag) and not tag.endswith(":<none>")
+    ][PREVIOUS_REVISIONS_KEPT:]
+    for tag in stale:
+        # Fails harmlessly if a container still uses it; retried next build
+        removed = subprocess.run(["docker", "rmi", tag], capture_output=True, text=True, env=env)
+        if removed.returncode == 0:
+            print(f"Removed old image {tag}")
+
+def run_streaming(command, timeout, env=None, cancel=None):
+    """
+    Run command, echoing its output line by line as it is produced
+
+    Only the last BUILD_LOG_TAIL lines are kept in memory. Returns
+    (returncode, tail) and raises subprocess.TimeoutExpired on timeout.
+    Setting the optional cancel event kills the command and raises.
+    """
+    proc = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+        text=True, bufsize=1, env=env
+    )
+    timed_out = threading.Event()
+    finished = threading.Event()
+    deadline = time.time() + timeout
+
+    def watchdog():
+        # Kill the command on timeout or cancel, whichever comes first
+        while not finished.wait(CANCEL_POLL_INTERVAL):
+            if cancel is not None and cancel.is_set():
+                proc.kill()
+                return
+            if time.time() >= deadline:
+                timed_out.set()
+                proc.kill()
+                return
+
+    threading.Thread(target=watchdog, daemon=True).start()
+    tail = deque(maxlen=BUILD_LOG_TAIL)
+    try:
+        with proc.stdout:
+            for line in proc.stdout:
+                line = line.rstrip()
+                print(f"  {line}")
+                tail.append(line)
+        returncode = proc.wait()
+    finally:
+        finished.set()
+
+    if cancel is not None and cancel.is_set():
+        raise Exception(f"{command[0]} was cancelled")
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(command, timeout, output="\n".join(tail))
+    return returncode, "\n".join(tail)
+
+def reset_minikube_cache():
+    """Forget cached Minikube status and docker-env"""
+    global _minikube_ok_until, _minikube_docker_env
+    _minikube_ok_until = 0.0
+    _minikube_docker_env = None
 
 def get_minikube_docker_env():
     """Get Minikube's Docker environment variables with improved parsing"""
+    global _minikube_docker_env
+    if _minikube_docker_env is not None and time.time() < _minikube_ok_until:
+        return _minikube_docker_env
     try:
         result = subprocess.run(
             ["minikube", "docker-env", "--shell", "powershell"],
@@ -17,12 +178,11 @@ def get_minikube_docker_env():
         # Parse PowerShell format: $Env:VAR = "value" or $Env:VAR="value"
         for line in result.stdout.split('\n'):
             line = line.strip()
-            if line.startswith('$Env:'):
+            if line.startswith(_PS_ENV_PREFIX):
                 # Remove $Env: prefix
-                line = line.replace('$Env:', '', 1)
+                line = line[len(_PS_ENV_PREFIX):]
                 # Handle both formats: VAR = "value" and VAR="value"
-                # Match: VAR = "value" or VAR="value"
-                match = re.match(r'^(\w+)\s*=\s*["\']?([^"\']+)["\']?', line)
+                match = _ENV_LINE_RE.match(line)
                 if match:
                     var_name, var_value = match.groups()
                     env[var_name] = var_value.strip()
@@ -38,6 +198,7 @@ def get_minikube_docker_env():
         # Validate that we got the important variables
         if 'DOCKER_HOST' in env or 'DOCKER_TLS_VERIFY' in env:
             print(f"Successfully parsed Minikube Docker environment")
+            _minikube_docker_env = env
             return env
         else:
             print("Warning: Minikube Docker env parsed but missing key variables")
@@ -50,21 +211,71 @@ def get_minikube_docker_env():
         print(f"Warning: Error getting Minikube Docker env: {e}")
         return None
 
+def load_image_into_minikube(image_tag, timeout=120):
+    """
+    Copy an image from the host Docker daemon into Minikube's
+
+    `docker save` is piped straight into `docker load` against Minikube's
+    daemon, so the image tarball is never staged on disk. Falls back to
+    `minikube image load` when the docker-env can't be obtained.
+    Returns (success, error output).
+    """
+    docker_env = get_minikube_docker_env()
+    if docker_env is None:
+        result = subprocess.run(
+            ["minikube", "image", "load", image_tag],
+            capture_output=True, text=True, timeout=timeout
+        )
+        return result.returncode == 0, result.stderr or result.stdout
+
+    # Skip the copy when Minikube already has this exact image, or has the
+    # only copy of it because it was built in Minikube's daemon
+    remote_id = image_id(image_tag, env=docker_env)
+    if remote_id is not None:
+        local_id = image_id(image_tag)
+        if local_id is None or local_id == remote_id:
+            print(f"Image {image_tag} already present in Minikube, skipping load")
+            return True, ""
+
+    save = subprocess.Popen(["docker", "save", image_tag], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    load = subprocess.Popen(
+        ["docker", "load"], stdin=save.stdout,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=docker_env
+    )
+    # Let docker save see a closed pipe if docker load exits early
+    save.stdout.close()
+    try:
+        _, load_err = load.communicate(timeout=timeout)
+        save_err = save.stderr.read()
+        save.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        save.kill()
+        load.kill()
+        raise
+    finally:
+        save.stderr.close()
+
+    if save.returncode != 0:
+        return False, save_err.decode(errors="replace")
+    if load.returncode != 0:
+        return False, load_err.decode(errors="replace")
+    return True, ""
+
 def build_with_minikube_image(image_tag, app_path):
     """Try using minikube image build command (newer approach)"""
     try:
         print("Trying minikube image build...")
         # Convert Windows path to Unix-style for minikube
         app_path_unix = app_path.replace('\\', '/')
-        result = subprocess.run(
+        returncode, _ = run_streaming(
             ["minikube", "image", "build", "-t", image_tag, app_path_unix],
-            capture_output=True, text=True, timeout=600
+            timeout=600
         )
-        if result.returncode == 0:
+        if returncode == 0:
             print(f"Successfully built image using minikube image build")
             return True
         else:
-            print(f"minikube image build failed: {result.stderr}")
+            print(f"minikube image build failed with exit code {returncode}")
             return False
     except Exception as e:
         print(f"minikube image build error: {e}")
@@ -75,87 +286,134 @@ def build_locally_and_load(image_tag, app_path):
     try:
         print("Building image locally, then loading into Minikube...")
         # Build locally
-        result = subprocess.run(
-            ["docker", "build", "-t", image_tag, app_path],
-            capture_output=True, text=True, timeout=600
+        returncode, _ = run_streaming(
+            docker_build_command(image_tag, app_path),
+            timeout=600, env=buildkit_env()
         )
-        if result.returncode != 0:
-            print(f"Local Docker build failed: {result.stderr}")
+        if returncode != 0:
+            print(f"Local Docker build failed with exit code {returncode}")
             return False
         
         # Load into Minikube
         print("Loading image into Minikube...")
-        result = subprocess.run(
-            ["minikube", "image", "load", image_tag],
-            capture_output=True, text=True, timeout=120
-        )
-        if result.returncode == 0:
+        loaded, error = load_image_into_minikube(image_tag)
+        if loaded:
             print(f"Successfully loaded image into Minikube")
             return True
         else:
-            print(f"Failed to load image into Minikube: {result.stderr}")
+            print(f"Failed to load image into Minikube: {error}")
             return False
     except Exception as e:
         print(f"Build and load error: {e}")
         return False
 
-def ensure_minikube_running():
-    """Check if Minikube is running"""
+def minikube_is_running():
+    """Check if Minikube is running (a positive answer is cached for MINIKUBE_CHECK_TTL seconds)"""
+    global _minikube_ok_until
+    if time.time() < _minikube_ok_until:
+        return True
     try:
         result = subprocess.run(
             ["minikube", "status", "--format", "{{.Host}}"],
             capture_output=True, text=True, timeout=5
         )
-        return result.stdout.strip() == "Running"
     except:
         return False
+    running = result.stdout.strip() == "Running"
+    if running:
+        _minikube_ok_until = time.time() + MINIKUBE_CHECK_TTL
+    return running
 
-def build_docker_image(app_name, app_path):
-    """Build Docker image for Minikube with multiple fallback strategies"""
+async def warm_base_images(images):
+    """Pre-pull common base images into the Docker daemon builds will use"""
+    minikube_running = await asyncio.to_thread(minikube_is_running)
+    docker_env = await asyncio.to_thread(get_minikube_docker_env) if minikube_running else None
+
+    async def pull(image):
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "docker", "pull", image, env=docker_env,
+                stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL
+            )
+        except OSError as e:
+            # e.g. docker not on PATH; nobody awaits this task to see it raise
+            print(f"Warning: Could not pre-pull base image {image}: {e}")
+            return
+        if await proc.wait() == 0:
+            print(f"✓ Pre-pulled base image {image}")
+        else:
+            print(f"Warning: Could not pre-pull base image {image}")
+
+    await asyncio.gather(*(pull(image) for image in images))
+
+def build_docker_image(app_name, app_path, cancel=None):
+    """
+    Build Docker image for Minikube with multiple fallback strategies
+
+    Returns a content-addressed tag so Kubernetes only rolls pods when the
+    image contents actually change. Setting the optional cancel event
+    (a threading.Event) kills a running docker build.
+    """
     image_tag = f"gitdeploy/{app_name}:latest"
-    
-    print(f"Building Docker image: {image_tag}")
-    
+    try:
+        content_tag = f"gitdeploy/{app_name}:{compute_content_hash(app_path)}"
+    except subprocess.CalledProcessError as e:
+        raise Exception(f"Failed to read repository HEAD: {e.stderr}")
+
     # Check if Minikube is running
-    minikube_running = ensure_minikube_running()
+    minikube_running = minikube_is_running()
+
+    # Build straight into Minikube's Docker daemon when we can reach it, so
+    # the image never has to be exported and re-imported with image load
+    docker_env = get_minikube_docker_env() if minikube_running else None
+
+    # Nothing changed since the last build of this tag: skip docker build
+    if image_exists(content_tag, env=docker_env):
+        print(f"Image {content_tag} is up to date, skipping build")
+        subprocess.run(["docker", "tag", content_tag, image_tag], env=docker_env, check=False)
+        remove_stale_images(app_name, content_tag, env=docker_env)
+        return content_tag
+    
+    print(f"Building Docker image: {content_tag}")
     
-    # Strategy 1: Build locally and load into Minikube (most reliable)
-    # This works regardless of Minikube Docker daemon connection issues
-    print("Building image locally...")
+    if docker_env:
+        print("Building image in Minikube's Docker daemon...")
+    else:
+        # Fallback: build locally and load into Minikube
+        print("Building image locally...")
     try:
-        build_result = subprocess.run(
-            ["docker", "build", "-t", image_tag, app_path],
-            check=True,
-            timeout=600,
-            capture_output=True,
-            text=True
+        build_command = docker_build_command(image_tag, app_path, extra_tags=[content_tag])
+        returncode, build_log = run_streaming(
+            build_command, timeout=600, env=buildkit_env(docker_env), cancel=cancel
         )
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, build_command, output=build_log)
         print("✓ Image built successfully")
+        remove_stale_images(app_name, content_tag, env=docker_env)
         
-        # If Minikube is running, load the image
-        if minikube_running:
+        if docker_env:
+            print("✓ Image is already in Minikube")
+        elif minikube_running:
+            # If Minikube is running, load the image
             print("Loading image into Minikube...")
-            load_result = subprocess.run(
-                ["minikube", "image", "load", image_tag],
-                check=False,
-                timeout=120,
-                capture_output=True,
-                text=True
-            )
-            if load_result.returncode == 0:
+            loaded, error = load_image_into_minikube(content_tag)
+            if loaded:
                 print("✓ Image loaded into Minikube successfully")
             else:
-                print(f"Warning: Could not load image into Minikube: {load_result.stderr}")
+                print(f"Warning: Could not load image into Minikube: {error}")
                 print("Image will be loaded during deployment")
         else:
             print("Minikube not running. Image will be loaded when Minikube starts during deployment.")
         
-        return image_tag
+        return content_tag
         
     except subprocess.TimeoutExpired:
         raise Exception("Docker build timed out after 10 minutes")
     except subprocess.CalledProcessError as e:
+        # Minikube may have gone away; re-check it on the next build
+        reset_minikube_cache()
         error_msg = e.stderr if e.stderr else e.stdout if e.stdout else str(e)
         raise Exception(f"Docker build failed: {error_msg}")
     except Exception as e:
+        reset_minikube_cache()
         raise Exception(f"Failed to build Docker image: {e}")
\ No newline at end of file
@@ -1,6 +1,7 @@
 import os
+import httpx
 from dotenv import load_dotenv
-from groq import Groq
+from groq import AsyncGroq, Groq
 
 # Load environment variables from .env file
 load_dotenv()
@@ -12,21 +13,55 @@ if api_key:
 else:
     print("WARNING: GROQ_API_KEY not found in environment")
 
-client = Groq(
+# Keep connections alive between generations so repeat calls skip the
+# TCP + TLS handshake
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=10, keepalive_expiry=60)
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+client = AsyncGroq(
     api_key=os.environ.get("GROQ_API_KEY"),
+    http_client=httpx.AsyncClient(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
 )
 
+# Separate blocking client for scripts; an AsyncClient's pool is tied to the
+# event loop it was first used on, so it can't be shared via asyncio.run
+sync_client = Groq(
+    api_key=os.environ.get("GROQ_API_KEY"),
+    http_client=httpx.Client(limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT),
+)
 
-def call_ai(messages, model="llama-3.3-70b-versatile",system_prompt="You are a helpful assistant."):
-
-    print("LLM Called Generating docker files...")
 
-    chat_completion = client.chat.completions.create(
-        messages=[
+def _completion_args(messages, model, system_prompt):
+    # Deterministic sampling so identical inputs give identical Dockerfiles
+    return {
+        "messages": [
             {"role": "system", "content": system_prompt},
             *messages
         ],
-        model=model,
+        "model": model,
+        "temperature": 0,
+        "seed": 0,
+    }
+
+
+async def call_ai(messages, model="llama-3.3-70b-versatile",system_prompt="You are a helpful assistant."):
+
+    print("LLM Called Generating docker files...")
+
+    chat_completion = await client.chat.completions.create(
+        **_completion_args(messages, model, system_prompt)
+    )
+
+    return chat_completion.choices[0].message.content
+
+
+def call_ai_sync(messages, model="llama-3.3-70b-versatile",system_prompt="You are a helpful assistant."):
+    """Blocking variant of call_ai for use outside the FastAPI event loop"""
+
+    print("LLM Called Generating docker files...")
+
+    chat_completion = sync_client.chat.completions.create(
+        **_completion_args(messages, model, system_prompt)
     )
 
-    return chat_completion.choices[0].message.content
\ No newline at end of file
+    return chat_completion.choices[0].message.content
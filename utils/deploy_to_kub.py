@@ -1,96 +1,214 @@
 import os
+import functools
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
-import tempfile
 import time
 import re
 import json
+import string
+import threading
+import urllib3
+import yaml
+from kubernetes import client, config, watch
+from kubernetes.client.rest import ApiException
+from kubernetes.dynamic import DynamicClient
+from utils.build_docker_image import (
+    exposed_port, get_minikube_docker_env, image_exists, load_image_into_minikube,
+    minikube_is_running, reset_minikube_cache,
+)
 
 INGRESS_PORT = 80  # Single port for all apps via Ingress
+FIELD_MANAGER = "kubehost"  # Server-side apply field manager
+WATCH_RETRY_DELAY = 2  # Seconds between attempts to re-open a dropped watch
+WATCH_MAX_RETRIES = 5  # Consecutive connection failures before giving up
+# libyaml's C loader when PyYAML was built with it; use the matching
+# CSafeDumper for any yaml.dump added later
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
+# Cluster checks are stable for the life of the process, so cache them;
+# Minikube's own status lives with the build module's docker-env cache
+_ingress_ready = False
+
+# One ApiClient per process so every API call reuses its pooled HTTPS
+# connection instead of paying kubectl startup and a TLS handshake
+_api_client = None
+_dynamic_client = None
+
+# Deploys run on worker threads (deploy_many, the web pipeline), so the cached
+# cluster state is only checked, built or reset under this lock; a failing
+# deploy's reset then makes the next caller re-verify once, not every thread
+_cluster_lock = threading.RLock()
+# Client creation has its own lock so API calls from other deploys aren't held
+# up behind a long ingress wait; always taken after _cluster_lock, never before
+_client_lock = threading.Lock()
+
+_NON_ALNUM = re.compile(r'[^a-z0-9-]')
+_DASHES = re.compile(r'-+')
+# KEY=VALUE per line; comment lines (leading #) and lines without a key are skipped
+_ENV_ASSIGNMENT = re.compile(r'^[ \t]*([^#=\s][^=\r\n]*?)[ \t]*=[ \t]*(.*?)[ \t\r]*$', re.MULTILINE)
+
+@functools.lru_cache(maxsize=1024)
 def sanitize_name(name):
     """Sanitize name for Kubernetes (lowercase, alphanumeric, hyphens only)"""
-    name = name.lower()
-    name = re.sub(r'[^a-z0-9-]', '-', name)
-    name = re.sub(r'-+', '-', name)
-    name = name.strip('-')
+    name = _DASHES.sub('-', _NON_ALNUM.sub('-', name.lower())).strip('-')
     return name[:63]  # K8s name limit
 
+def reset_cluster_checks():
+    """Forget cached Minikube/ingress checks so the next deploy re-verifies them"""
+    global _ingress_ready, _api_client, _dynamic_client
+    with _cluster_lock:
+        reset_minikube_cache()
+        _ingress_ready = False
+        # A restarted Minikube may come back on a new port/cert
+        with _client_lock:
+            if _api_client is not None:
+                # Release its connection pool rather than leaking it
+                _api_client.close()
+            _api_client = None
+            _dynamic_client = None
+
+def get_api_client():
+    """Shared Kubernetes ApiClient, created lazily because Minikube writes the kubeconfig on start"""
+    global _api_client
+    with _client_lock:
+        if _api_client is None:
+            config.load_kube_config()
+            _api_client = client.ApiClient()
+        return _api_client
+
+def dynamic_client():
+    """DynamicClient on the shared ApiClient; resolves any apiVersion/kind to its REST path"""
+    global _dynamic_client
+    api_client = get_api_client()
+    with _client_lock:
+        if _dynamic_client is None:
+            _dynamic_client = DynamicClient(api_client)
+        return _dynamic_client
+
+def apps_api():
+    return client.AppsV1Api(get_api_client())
+
+def core_api():
+    return client.CoreV1Api(get_api_client())
+
 def ensure_minikube_running():
-    """Ensure Minikube is running"""
-    result = subprocess.run(
-        ["minikube", "status", "--format", "{{.Host}}"],
-        capture_output=True, text=True
+    """Start Minikube unless the shared (cached) status check says it is up"""
+    if minikube_is_running():
+        return
+
+    print("Starting Minikube...")
+    subprocess.run(["minikube", "start", "--driver=docker"], check=True)
+    # A fresh start can move the docker daemon and apiserver to new ports
+    reset_cluster_checks()
+
+INGRESS_NAMESPACE = "ingress-nginx"
+INGRESS_CONTROLLER_SELECTOR = "app.kubernetes.io/component=controller"
+
+def pod_ready(pod):
+    return any(
+        condition.type == "Ready" and condition.status == "True"
+        for condition in pod.status.conditions or []
     )
-    if result.stdout.strip() != "Running":
-        print("Starting Minikube...")
-        subprocess.run(["minikube", "start", "--driver=docker"], check=True)
+
+def ingress_controller_ready():
+    """True if the ingress-nginx controller pod is already Ready"""
+    try:
+        pods = core_api().list_namespaced_pod(
+            INGRESS_NAMESPACE, label_selector=INGRESS_CONTROLLER_SELECTOR
+        )
+    except Exception:
+        return False
+    return any(pod_ready(pod) for pod in pods.items)
+
+def wait_for_ingress_controller(timeout=180):
+    """Watch the ingress-nginx namespace until a controller pod is Ready"""
+    w = watch.Watch()
+    try:
+        for event in w.stream(
+            core_api().list_namespaced_pod, INGRESS_NAMESPACE,
+            label_selector=INGRESS_CONTROLLER_SELECTOR, timeout_seconds=timeout
+        ):
+            if event["type"] in ("ADDED", "MODIFIED") and pod_ready(event["object"]):
+                w.stop()
+                return True
+    except (ApiException, urllib3.exceptions.HTTPError) as e:
+        print(f"Warning: Watching ingress controller failed: {e}")
+    return False
 
 def ensure_ingress_controller():
-    """Enable Minikube ingress addon if not already enabled"""
+    """Enable Minikube ingress addon if not already enabled (cached once ready)"""
+    global _ingress_ready
+    if _ingress_ready:
+        return
+
+    # Warm path: controller is already up, no addon listing or wait needed
+    if ingress_controller_ready():
+        _ingress_ready = True
+        return
+
     result = subprocess.run(
         ["minikube", "addons", "list", "-o", "json"],
         capture_output=True, text=True
     )
+    try:
+        addons = json.loads(result.stdout)
+    except ValueError:
+        addons = {}
     
-    if '"ingress":' not in result.stdout or '"Status":"enabled"' not in result.stdout:
+    if addons.get("ingress", {}).get("Status") != "enabled":
         subprocess.run(["minikube", "addons", "enable", "ingress"], check=True)
-        print("Waiting for ingress controller to be ready...")
-        subprocess.run([
-            "kubectl", "wait", "--namespace", "ingress-nginx",
-            "--for=condition=ready", "pod",
-            "--selector=app.kubernetes.io/component=controller",
-            "--timeout=180s"
-        ], check=False)
+    print("Waiting for ingress controller to be ready...")
+    if not wait_for_ingress_controller(timeout=180):
+        # Don't cache a controller that never became ready
+        return
+    _ingress_ready = True
+
+def prepare_cluster():
+    """Start Minikube and the ingress controller ahead of a deploy"""
+    # One thread checks at a time; the rest find the result cached
+    with _cluster_lock:
+        print("Checking Minikube status...")
+        ensure_minikube_running()
+        print("Checking ingress controller...")
+        ensure_ingress_controller()
 
 def extract_port_from_dockerfile(app_path):
     """Extract port from Dockerfile EXPOSE directive or return None"""
     dockerfile_path = os.path.join(app_path, "Dockerfile")
     if os.path.exists(dockerfile_path):
         with open(dockerfile_path, "r", encoding='utf-8') as f:
-            content = f.read()
-            # Look for EXPOSE directive
-            match = re.search(r'EXPOSE\s+(\d+)', content, re.IGNORECASE)
-            if match:
-                return int(match.group(1))
+            return exposed_port(f.read())
     return None
 
+def parse_env_text(text):
+    """Parse KEY=VALUE lines into K8s env entries (comments and empty values skipped)"""
+    env_vars = []
+    # One regex pass over the text instead of a strip/split chain per line
+    for key, value in _ENV_ASSIGNMENT.findall(text):
+        value = value.strip('"').strip("'")
+        # Skip empty values
+        if value:
+            env_vars.append({"name": key, "value": value})
+    return env_vars
+
 def extract_env_vars(app_path):
     """Extract environment variables from .env file and convert to K8s format"""
     env_file_path = os.path.join(app_path, ".env")
-    env_vars = []
-    
-    if os.path.exists(env_file_path):
-        with open(env_file_path, "r", encoding='utf-8') as env_file:
-            for line in env_file:
-                line = line.strip()
-                if line and '=' in line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    key = key.strip()
-                    value = value.strip().strip('"').strip("'")
-                    # Skip empty values
-                    if key and value:
-                        env_vars.append({"name": key, "value": value})
-    
-    return env_vars
+    if not os.path.exists(env_file_path):
+        return []
+    with open(env_file_path, "r", encoding='utf-8') as env_file:
+        return parse_env_text(env_file.read())
 
 def validate_image_exists(image_tag):
     """Validate that the Docker image exists in Minikube"""
     try:
-        # Get Minikube docker env
-        result = subprocess.run(
-            ["minikube", "docker-env", "--shell", "powershell"],
-            capture_output=True, text=True
-        )
-        if result.returncode != 0:
+        # Ask Minikube's own daemon, reusing the docker env cached by the build
+        docker_env = get_minikube_docker_env()
+        if docker_env is None:
             print("Warning: Could not get Minikube docker env for image validation")
             return True  # Assume exists if we can't check
         
-        # Check if image exists
-        result = subprocess.run(
-            ["docker", "images", image_tag, "--format", "{{.Repository}}:{{.Tag}}"],
-            capture_output=True, text=True
-        )
-        if result.stdout.strip() == image_tag:
+        if image_exists(image_tag, env=docker_env):
             return True
         else:
             print(f"Warning: Image {image_tag} not found. Deployment may fail.")
@@ -102,207 +220,158 @@ def validate_image_exists(image_tag):
 def get_pod_errors(namespace, app_name):
     """Get error messages from pods for debugging"""
     try:
-        result = subprocess.run(
-            ["kubectl", "get", "pods", "-n", namespace, "-l", f"app={app_name}", "-o", "json"],
-            capture_output=True, text=True
+        # Raw JSON rather than V1Pod models: the client's model
+        # deserialization costs far more than the few fields read here
+        response = core_api().list_namespaced_pod(
+            namespace, label_selector=f"app={app_name}", _preload_content=False
         )
-        if result.returncode == 0:
-            pods_data = json.loads(result.stdout)
-            errors = []
-            for pod in pods_data.get("items", []):
-                pod_name = pod.get("metadata", {}).get("name", "unknown")
-                status = pod.get("status", {})
-                
-                # Check container statuses
-                for container_status in status.get("containerStatuses", []):
-                    state = container_status.get("state", {})
-                    if "waiting" in state:
-                        reason = state["waiting"].get("reason", "")
-                        message = state["waiting"].get("message", "")
-                        errors.append(f"Pod {pod_name}: Waiting - {reason}: {message}")
-                    elif "terminated" in state:
-                        reason = state["terminated"].get("reason", "")
-                        message = state["terminated"].get("message", "")
-                        errors.append(f"Pod {pod_name}: Terminated - {reason}: {message}")
-                
-                # Check pod conditions
-                for condition in status.get("conditions", []):
-                    if condition.get("status") == "False" and condition.get("type") in ["Ready", "PodScheduled"]:
-                        errors.append(f"Pod {pod_name}: {condition.get('type')} - {condition.get('message', '')}")
+        pods_data = json.loads(response.data)
+        errors = []
+        for pod in pods_data.get("items", []):
+            pod_name = pod.get("metadata", {}).get("name", "unknown")
+            status = pod.get("status", {})
             
-            return errors
+            # Check container statuses
+            for container_status in status.get("containerStatuses", []):
+                state = container_status.get("state", {})
+                if "waiting" in state:
+                    reason = state["waiting"].get("reason", "")
+                    message = state["waiting"].get("message", "")
+                    errors.append(f"Pod {pod_name}: Waiting - {reason}: {message}")
+                elif "terminated" in state:
+                    reason = state["terminated"].get("reason", "")
+                    message = state["terminated"].get("message", "")
+                    errors.append(f"Pod {pod_name}: Terminated - {reason}: {message}")
+            
+            # Check pod conditions
+            for condition in status.get("conditions", []):
+                if condition.get("status") == "False" and condition.get("type") in ["Ready", "PodScheduled"]:
+                    errors.append(f"Pod {pod_name}: {condition.get('type')} - {condition.get('message', '')}")
+        
+        return errors
     except Exception as e:
         return [f"Could not fetch pod errors: {e}"]
-    return []
+
+def rollout_complete(deployment):
+    """Same completion rule as kubectl rollout status"""
+    status = deployment.status
+    if (status.observed_generation or 0) < (deployment.metadata.generation or 0):
+        return False
+    # During a redeploy old pods keep the deployment available, so wait for
+    # every replica to be updated and the old ones to be gone
+    desired = deployment.spec.replicas if deployment.spec.replicas is not None else 1
+    updated = status.updated_replicas or 0
+    return (
+        updated >= desired
+        and (status.replicas or 0) <= updated
+        and (status.available_replicas or 0) >= updated
+    )
 
 def wait_for_deployment(app_name, namespace, timeout=180):
-    """Wait for deployment to be ready with better error reporting"""
+    """
+    Block on a watch of the deployment until its rollout completes
+
+    Status changes are pushed by the apiserver as they happen. If the watch
+    connection drops before the timeout it is re-opened from the last seen
+    resourceVersion, so no events are missed and nothing is re-polled.
+    """
     print(f"Waiting for deployment {app_name} in namespace {namespace} to be ready...")
-    start_time = time.time()
+    deadline = time.time() + timeout
+    resource_version = None
     last_status = None
-    
-    while time.time() - start_time < timeout:
-        # Check deployment status
-        result = subprocess.run(
-            ["kubectl", "get", "deployment", app_name, "-n", namespace,
-             "-o", "jsonpath={.status.readyReplicas}"],
-            capture_output=True, text=True
-        )
-        
-        if result.returncode == 0:
-            ready = result.stdout.strip()
-            desired = subprocess.run(
-                ["kubectl", "get", "deployment", app_name, "-n", namespace,
-                 "-o", "jsonpath={.spec.replicas}"],
-                capture_output=True, text=True
-            ).stdout.strip()
-            
-            if ready and desired:
-                ready_int = int(ready)
-                desired_int = int(desired)
-                status = f"Ready: {ready_int}/{desired_int}"
+    failures = 0
+    w = watch.Watch()
+    while time.time() < deadline:
+        kwargs = {
+            "field_selector": f"metadata.name={app_name}",
+            "timeout_seconds": max(1, int(deadline - time.time())),
+        }
+        if resource_version:
+            kwargs["resource_version"] = resource_version
+        try:
+            for event in w.stream(apps_api().list_namespaced_deployment, namespace, **kwargs):
+                if event["type"] not in ("ADDED", "MODIFIED"):
+                    continue
+                deployment = event["object"]
+                resource_version = deployment.metadata.resource_version
+                failures = 0
+                status = f"Ready: {deployment.status.ready_replicas or 0}/{deployment.spec.replicas}"
                 if status != last_status:
                     print(f"  {status}")
                     last_status = status
-                
-                if ready_int >= desired_int and ready_int >= 1:
+
+                if rollout_complete(deployment):
+                    w.stop()
                     print(f"Deployment {app_name} is ready!")
                     return True
-        
-        # Check for pod errors periodically
-        if int(time.time() - start_time) % 30 == 0:  # Every 30 seconds
-            errors = get_pod_errors(namespace, app_name)
-            if errors:
-                print(f"  Pod errors detected: {errors[0]}")
-        
-        time.sleep(5)
-    
-    # Final error check
-    errors = get_pod_errors(namespace, app_name)
-    if errors:
-        print(f"Deployment failed. Pod errors: {errors}")
-    
+        except ApiException as e:
+            if e.status != 410:
+                print(f"Warning: Watching deployment {app_name} failed: {e.reason}")
+                break
+            # resourceVersion too old; restart from a fresh list
+            resource_version = None
+        except urllib3.exceptions.HTTPError as e:
+            # An unreachable apiserver fails instantly; don't spin on it
+            failures += 1
+            if failures >= WATCH_MAX_RETRIES:
+                print(f"Warning: Watching deployment {app_name} failed: {e}")
+                break
+            print(f"  Watch connection dropped ({e}), resuming...")
+            time.sleep(min(WATCH_RETRY_DELAY, max(0, deadline - time.time())))
+
+    # Pod errors are collected once by the caller, not here as well
     return False
 
-def deploy_to_k8s(app_name, image_tag, app_type, app_path=None, env_vars=None):
+def apply_manifest(manifest):
     """
-    Deploy application to Kubernetes
-    
-    Args:
-        app_name: Name of the application
-        image_tag: Docker image tag
-        app_type: Type of application (nodejs, python, static)
-        app_path: Path to application directory (for port detection and env vars)
-        env_vars: Optional environment variables string (if not provided, will read from .env)
+    Server-side apply each YAML document in manifest through the API client
+
+    Documents go out in order over the shared connection, so the namespace
+    exists before its contents. Conflicts are forced so a redeploy takes back
+    fields such as replicas, matching what kubectl apply did before.
     """
-    try:
-        # Sanitize names for K8s compatibility
-        app_name = sanitize_name(app_name)
-        namespace = f"app-{app_name}"
-        
-        print(f"Deploying {app_name} to Kubernetes...")
-        
-        # Determine port - try to extract from Dockerfile first
-        port = None
-        if app_path:
-            port = extract_port_from_dockerfile(app_path)
-        
-        # Fallback to default ports based on app type
-        if port is None:
-            port = 3000 if app_type in ["nodejs", "nextjs"] else 8000 if app_type == "python" else 80
-        
-        print(f"Using port: {port}")
-        
-        # Extract environment variables
-        env_list = []
-        if app_path:
-            env_list = extract_env_vars(app_path)
-        elif env_vars:
-            # Parse env_vars string if provided directly
-            for line in env_vars.split('\n'):
-                line = line.strip()
-                if line and '=' in line and not line.startswith('#'):
-                    key, value = line.split('=', 1)
-                    key = key.strip()
-                    value = value.strip().strip('"').strip("'")
-                    if key and value:
-                        env_list.append({"name": key, "value": value})
-        
-        if env_list:
-            print(f"Found {len(env_list)} environment variables to inject")
-        
-        # Ensure Minikube is running
-        print("Checking Minikube status...")
-        ensure_minikube_running()
-        
-        # Ensure ingress controller is installed
-        print("Checking ingress controller...")
-        ensure_ingress_controller()
-        
-        # Ensure image is loaded into Minikube
-        print(f"Ensuring image {image_tag} is available in Minikube...")
-        try:
-            # Try to load the image if it exists locally
-            load_result = subprocess.run(
-                ["minikube", "image", "load", image_tag],
-                check=False,
-                timeout=120,
-                capture_output=True,
-                text=True
-            )
-            if load_result.returncode == 0:
-                print("✓ Image loaded into Minikube")
-            else:
-                # Image might already be there, or load failed - continue anyway
-                print(f"Note: Image load result: {load_result.stdout if load_result.stdout else 'already exists or load skipped'}")
-        except Exception as e:
-            print(f"Warning: Could not load image into Minikube: {e}")
-            print("Continuing with deployment - image may already exist in Minikube")
-        
-        # Validate image exists (optional check)
-        validate_image_exists(image_tag)
-        
-        # Determine health check path based on framework
-        health_check_path = "/"
-        if app_type == "python":
-            # FastAPI and Django often have /health or /healthz endpoints
-            health_check_path = "/health"
-        elif app_type in ["nodejs", "nextjs"]:
-            # Next.js and NestJS might have /api/health
-            health_check_path = "/"
-        
-        # Build environment variables YAML
-        env_yaml = ""
-        if env_list:
-            env_yaml = "\n        env:"
-            for env_var in env_list:
-                env_yaml += f'\n        - name: {env_var["name"]}\n          value: "{env_var["value"]}"'
-        
-        # Namespace YAML - isolated namespace per app/user
-        namespace_yaml = f"""
+    for doc in yaml.load_all(manifest, Loader=YAML_LOADER):
+        if not doc:
+            continue
+        metadata = doc["metadata"]
+        resource = dynamic_client().resources.get(api_version=doc["apiVersion"], kind=doc["kind"])
+        dynamic_client().server_side_apply(
+            resource,
+            body=doc,
+            name=metadata["name"],
+            namespace=metadata.get("namespace"),
+            field_manager=FIELD_MANAGER,
+            force_conflicts=True,
+        )
+        print(f"  Applied {doc['kind'].lower()}/{metadata['name']}")
+
+# Manifest templates are parsed once at import instead of per deploy
+
+# Namespace YAML - isolated namespace per app/user
+_NAMESPACE_TEMPLATE = string.Template("""
 apiVersion: v1
 kind: Namespace
 metadata:
-  name: {namespace}
+  name: ${namespace}
   labels:
-    app: {app_name}
+    app: ${app_name}
     managed-by: kubehost
-"""
+""")
 
-        # Deployment YAML with 3 replicas max, resource limits, and health checks
-        deployment_yaml = f"""
+# Deployment YAML with 3 replicas max, resource limits, and health checks
+_DEPLOYMENT_TEMPLATE = string.Template("""
 apiVersion: apps/v1
 kind: Deployment
 metadata:
-  name: {app_name}
-  namespace: {namespace}
+  name: ${app_name}
+  namespace: ${namespace}
   labels:
-    app: {app_name}
+    app: ${app_name}
 spec:
   replicas: 3
   selector:
     matchLabels:
-      app: {app_name}
+      app: ${app_name}
   strategy:
     type: RollingUpdate
     rollingUpdate:
@@ -311,15 +380,15 @@ spec:
   template:
     metadata:
       labels:
-        app: {app_name}
+        app: ${app_name}
     spec:
       containers:
-      - name: {app_name}
-        image: {image_tag}
+      - name: ${app_name}
+        image: ${image_tag}
         imagePullPolicy: Never
         ports:
-        - containerPort: {port}
-          protocol: TCP{env_yaml}
+        - containerPort: ${port}
+          protocol: TCP${env_yaml}
         resources:
           requests:
             memory: "128Mi"
@@ -329,49 +398,49 @@ spec:
             cpu: "500m"
         readinessProbe:
           httpGet:
-            path: {health_check_path}
-            port: {port}
+            path: ${health_check_path}
+            port: ${port}
           initialDelaySeconds: 15
           periodSeconds: 5
           timeoutSeconds: 3
           failureThreshold: 5
         livenessProbe:
           httpGet:
-            path: {health_check_path}
-            port: {port}
+            path: ${health_check_path}
+            port: ${port}
           initialDelaySeconds: 40
           periodSeconds: 10
           timeoutSeconds: 3
           failureThreshold: 3
-"""
+""")
 
-        # ClusterIP Service (internal only, Ingress handles external)
-        service_yaml = f"""
+# ClusterIP Service (internal only, Ingress handles external)
+_SERVICE_TEMPLATE = string.Template("""
 apiVersion: v1
 kind: Service
 metadata:
-  name: {app_name}-svc
-  namespace: {namespace}
+  name: ${app_name}-svc
+  namespace: ${namespace}
   labels:
-    app: {app_name}
+    app: ${app_name}
 spec:
   selector:
-    app: {app_name}
+    app: ${app_name}
   ports:
     - name: http
       protocol: TCP
       port: 80
-      targetPort: {port}
+      targetPort: ${port}
   type: ClusterIP
-"""
+""")
 
-        # Ingress for subdomain-based routing - works with all frameworks
-        ingress_yaml = f"""
+# Ingress for subdomain-based routing - works with all frameworks
+_INGRESS_TEMPLATE = string.Template("""
 apiVersion: networking.k8s.io/v1
 kind: Ingress
 metadata:
-  name: {app_name}-ingress
-  namespace: {namespace}
+  name: ${app_name}-ingress
+  namespace: ${namespace}
   annotations:
     nginx.ingress.kubernetes.io/ssl-redirect: "false"
     nginx.ingress.kubernetes.io/proxy-body-size: "50m"
@@ -380,30 +449,30 @@ metadata:
 spec:
   ingressClassName: nginx
   rules:
-  - host: {app_name}.localhost
+  - host: ${app_name}.localhost
     http:
       paths:
       - path: /
         pathType: Prefix
         backend:
           service:
-            name: {app_name}-svc
+            name: ${app_name}-svc
             port:
               number: 80
-"""
+""")
 
-        # HorizontalPodAutoscaler for auto-scaling (max 3 replicas as requested)
-        hpa_yaml = f"""
+# HorizontalPodAutoscaler for auto-scaling (max 3 replicas as requested)
+_HPA_TEMPLATE = string.Template("""
 apiVersion: autoscaling/v2
 kind: HorizontalPodAutoscaler
 metadata:
-  name: {app_name}-hpa
-  namespace: {namespace}
+  name: ${app_name}-hpa
+  namespace: ${namespace}
 spec:
   scaleTargetRef:
     apiVersion: apps/v1
     kind: Deployment
-    name: {app_name}
+    name: ${app_name}
   minReplicas: 1
   maxReplicas: 3
   metrics:
@@ -419,19 +488,19 @@ spec:
       target:
         type: Utilization
         averageUtilization: 80
-"""
+""")
 
-        # NetworkPolicy for namespace isolation
-        network_policy_yaml = f"""
+# NetworkPolicy for namespace isolation
+_NETWORK_POLICY_TEMPLATE = string.Template("""
 apiVersion: networking.k8s.io/v1
 kind: NetworkPolicy
 metadata:
-  name: {app_name}-network-policy
-  namespace: {namespace}
+  name: ${app_name}-network-policy
+  namespace: ${namespace}
 spec:
   podSelector:
     matchLabels:
-      app: {app_name}
+      app: ${app_name}
   policyTypes:
   - Ingress
   - Egress
@@ -442,18 +511,18 @@ spec:
           kubernetes.io/metadata.name: ingress-nginx
     ports:
     - protocol: TCP
-      port: {port}
+      port: ${port}
   egress:
   - to: []
-"""
+""")
 
-        # ResourceQuota to limit namespace resources
-        quota_yaml = f"""
+# ResourceQuota to limit namespace resources
+_QUOTA_TEMPLATE = string.Template("""
 apiVersion: v1
 kind: ResourceQuota
 metadata:
-  name: {app_name}-quota
-  namespace: {namespace}
+  name: ${app_name}-quota
+  namespace: ${namespace}
 spec:
   hard:
     requests.cpu: "2"
@@ -461,15 +530,15 @@ spec:
     limits.cpu: "4"
     limits.memory: 4Gi
     pods: "20"
-"""
+""")
 
-        # LimitRange for default container limits
-        limit_range_yaml = f"""
+# LimitRange for default container limits
+_LIMIT_RANGE_TEMPLATE = string.Template("""
 apiVersion: v1
 kind: LimitRange
 metadata:
-  name: {app_name}-limits
-  namespace: {namespace}
+  name: ${app_name}-limits
+  namespace: ${namespace}
 spec:
   limits:
   - default:
@@ -479,55 +548,126 @@ spec:
       memory: 128Mi
       cpu: 100m
     type: Container
-"""
-
-        # Write temp files
-        tmp_dir = tempfile.gettempdir()
-        files = {
-            "namespace": (os.path.join(tmp_dir, f"{app_name}-namespace.yaml"), namespace_yaml),
-            "quota": (os.path.join(tmp_dir, f"{app_name}-quota.yaml"), quota_yaml),
-            "limits": (os.path.join(tmp_dir, f"{app_name}-limits.yaml"), limit_range_yaml),
-            "deployment": (os.path.join(tmp_dir, f"{app_name}-deployment.yaml"), deployment_yaml),
-            "service": (os.path.join(tmp_dir, f"{app_name}-service.yaml"), service_yaml),
-            "ingress": (os.path.join(tmp_dir, f"{app_name}-ingress.yaml"), ingress_yaml),
-            "hpa": (os.path.join(tmp_dir, f"{app_name}-hpa.yaml"), hpa_yaml),
-            "network": (os.path.join(tmp_dir, f"{app_name}-network-policy.yaml"), network_policy_yaml),
-        }
-        
-        for name, (filepath, content) in files.items():
-            with open(filepath, "w", encoding='utf-8') as f:
-                f.write(content)
+""")
 
-        # Apply to Kubernetes cluster in order with error handling
-        print("Applying Kubernetes manifests...")
+def deploy_to_k8s(app_name, image_tag, app_type, app_path=None, env_vars=None, port=None):
+    """
+    Deploy application to Kubernetes
+    
+    Args:
+        app_name: Name of the application
+        image_tag: Docker image tag
+        app_type: Type of application (nodejs, python, static)
+        app_path: Path to application directory (for port detection and env vars)
+        env_vars: Optional environment variables string (if not provided, will read from .env)
+        port: Container port if already known (otherwise read from the Dockerfile)
+    """
+    try:
+        # Sanitize names for K8s compatibility
+        app_name = sanitize_name(app_name)
+        namespace = f"app-{app_name}"
         
-        apply_commands = [
-            ("namespace", True),
-            ("quota", True),
-            ("limits", True),
-            ("deployment", True),
-            ("service", True),
-            ("ingress", True),
-            ("hpa", False),  # May fail without metrics-server
-            ("network", True),
-        ]
+        print(f"Deploying {app_name} to Kubernetes...")
         
-        for resource_name, should_check in apply_commands:
-            filepath = files[resource_name][0]
-            print(f"  Applying {resource_name}...")
-            result = subprocess.run(
-                ["kubectl", "apply", "-f", filepath],
-                capture_output=True,
-                text=True,
-                check=should_check
+        # Determine port - fall back to re-reading the Dockerfile when the
+        # caller didn't pass the one found at generation time
+        if port is None and app_path:
+            port = extract_port_from_dockerfile(app_path)
+        
+        # Fallback to default ports based on app type
+        if port is None:
+            port = 3000 if app_type in ["nodejs", "nextjs"] else 8000 if app_type == "python" else 80
+        
+        print(f"Using port: {port}")
+        
+        # Extract environment variables
+        env_list = []
+        if app_path:
+            env_list = extract_env_vars(app_path)
+        elif env_vars:
+            # Parse env_vars string if provided directly
+            env_list = parse_env_text(env_vars)
+        
+        if env_list:
+            print(f"Found {len(env_list)} environment variables to inject")
+        
+        # Ensure Minikube and the ingress controller are up
+        prepare_cluster()
+        
+        # Ensure image is loaded into Minikube
+        print(f"Ensuring image {image_tag} is available in Minikube...")
+        try:
+            # Try to load the image if it exists locally
+            loaded, error = load_image_into_minikube(image_tag)
+            if loaded:
+                print("✓ Image loaded into Minikube")
+            else:
+                # Image might already be there, or load failed - continue anyway
+                print(f"Note: Image load result: {error.strip() or 'already exists or load skipped'}")
+        except Exception as e:
+            print(f"Warning: Could not load image into Minikube: {e}")
+            print("Continuing with deployment - image may already exist in Minikube")
+        
+        # Validate image exists (optional check)
+        validate_image_exists(image_tag)
+        
+        # Determine health check path based on framework
+        health_check_path = "/"
+        if app_type == "python":
+            # FastAPI and Django often have /health or /healthz endpoints
+            health_check_path = "/health"
+        elif app_type in ["nodejs", "nextjs"]:
+            # Next.js and NestJS might have /api/health
+            health_check_path = "/"
+        
+        # Build environment variables YAML
+        env_yaml = ""
+        if env_list:
+            env_yaml = "\n        env:" + "".join(
+                f'\n        - name: {env_var["name"]}\n          value: "{env_var["value"]}"'
+                for env_var in env_list
             )
-            
-            if result.returncode != 0:
-                error_msg = f"Failed to apply {resource_name}: {result.stderr}"
-                if should_check:
-                    raise Exception(error_msg)
-                else:
-                    print(f"  Warning: {error_msg}")
+        
+        # Values shared by every manifest template
+        params = {
+            "app_name": app_name,
+            "namespace": namespace,
+            "image_tag": image_tag,
+            "port": port,
+            "env_yaml": env_yaml,
+            "health_check_path": health_check_path,
+        }
+        namespace_yaml = _NAMESPACE_TEMPLATE.substitute(params)
+        deployment_yaml = _DEPLOYMENT_TEMPLATE.substitute(params)
+        service_yaml = _SERVICE_TEMPLATE.substitute(params)
+        ingress_yaml = _INGRESS_TEMPLATE.substitute(params)
+        hpa_yaml = _HPA_TEMPLATE.substitute(params)
+        network_policy_yaml = _NETWORK_POLICY_TEMPLATE.substitute(params)
+        quota_yaml = _QUOTA_TEMPLATE.substitute(params)
+        limit_range_yaml = _LIMIT_RANGE_TEMPLATE.substitute(params)
+
+        # Apply everything except the HPA in one pass; documents are applied
+        # in order so the namespace exists before its contents
+        print("Applying Kubernetes manifests...")
+        manifests = "\n---\n".join([
+            namespace_yaml,
+            quota_yaml,
+            limit_range_yaml,
+            deployment_yaml,
+            service_yaml,
+            ingress_yaml,
+            network_policy_yaml,
+        ])
+        try:
+            apply_manifest(manifests)
+        except ApiException as e:
+            raise Exception(f"Failed to apply manifests: {e.body or e.reason}")
+
+        # HPA may fail without metrics-server, so it is applied separately
+        try:
+            apply_manifest(hpa_yaml)
+        except Exception as e:
+            print(f"  Warning: Failed to apply hpa: {e}")
 
         # Wait for deployment to be ready
         print("Waiting for deployment to be ready...")
@@ -556,49 +696,81 @@ spec:
         return f"http://{app_name}.localhost"
     
     except subprocess.CalledProcessError as e:
+        # minikube itself failed, so re-verify the cluster on the next deploy
+        reset_cluster_checks()
         error_msg = f"Kubernetes deployment failed: {e.stderr if e.stderr else str(e)}"
         print(f"ERROR: {error_msg}")
         raise Exception(error_msg)
+    except (urllib3.exceptions.HTTPError, config.ConfigException) as e:
+        # The apiserver is unreachable or the kubeconfig changed under us
+        reset_cluster_checks()
+        error_msg = f"Deployment error: {str(e)}"
+        print(f"ERROR: {error_msg}")
+        raise Exception(error_msg)
     except Exception as e:
+        # App-level failure (bad probe, rejected manifest); the cluster
+        # caches and shared client are still good for other deploys
         error_msg = f"Deployment error: {str(e)}"
         print(f"ERROR: {error_msg}")
         raise Exception(error_msg)
 
 
+def deploy_many(specs, max_workers=4):
+    """
+    Deploy several apps concurrently
+
+    Each spec is a dict of deploy_to_k8s keyword arguments. Apps live in
+    separate namespaces, so their applies and rollout waits are independent;
+    the worker threads spend their time blocked on I/O. Returns the URLs in
+    spec order and re-raises the first failure.
+    """
+    # Start Minikube and the ingress addon once, before workers race to do it
+    prepare_cluster()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda spec: deploy_to_k8s(**spec), specs))
+
+
 def delete_app(app_name):
     """Delete an app and its namespace (cleans up everything)"""
     app_name = sanitize_name(app_name)
     namespace = f"app-{app_name}"
-    subprocess.run(["kubectl", "delete", "namespace", namespace], check=False)
+    try:
+        core_api().delete_namespace(namespace)
+    except ApiException as e:
+        print(f"Warning: Could not delete namespace {namespace}: {e.reason}")
 
 
 def get_app_status(app_name):
-    """Get deployment status for an app"""
+    """Get deployment status for an app, or None if it isn't deployed"""
     app_name = sanitize_name(app_name)
     namespace = f"app-{app_name}"
     
-    result = subprocess.run(
-        ["kubectl", "get", "all", "-n", namespace],
-        capture_output=True, text=True
-    )
-    return result.stdout
+    try:
+        deployment = apps_api().read_namespaced_deployment(app_name, namespace)
+    except ApiException as e:
+        if e.status == 404:
+            return None
+        raise
+    pods = core_api().list_namespaced_pod(namespace, label_selector=f"app={app_name}")
+    return {
+        "image": deployment.spec.template.spec.containers[0].image,
+        "replicas": deployment.spec.replicas,
+        "readyReplicas": deployment.status.ready_replicas or 0,
+        "availableReplicas": deployment.status.available_replicas or 0,
+        "pods": [{"name": pod.metadata.name, "phase": pod.status.phase} for pod in pods.items],
+    }
 
 
 def list_all_apps():
     """List all deployed apps"""
-    result = subprocess.run(
-        ["kubectl", "get", "namespaces", "-l", "managed-by=kubehost", "-o", "name"],
-        capture_output=True, text=True
-    )
-    namespaces = result.stdout.strip().split('\n')
-    return [ns.replace('namespace/app-', '') for ns in namespaces if ns]
+    namespaces = core_api().list_namespace(label_selector="managed-by=kubehost")
+    return [ns.metadata.name.replace('app-', '', 1) for ns in namespaces.items]
 
 
 def scale_app(app_name, replicas):
     """Scale an app to specified replicas"""
     app_name = sanitize_name(app_name)
     namespace = f"app-{app_name}"
-    subprocess.run([
-        "kubectl", "scale", "deployment", app_name,
-        f"--replicas={replicas}", "-n", namespace
-    ], check=True)
\ No newline at end of file
+    apps_api().patch_namespaced_deployment_scale(
+        app_name, namespace, {"spec": {"replicas": replicas}}
+    )
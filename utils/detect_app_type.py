@@ -1,11 +1,19 @@
 import os
 
+def list_names(path):
+    """Names of the entries in path, read with a single scandir"""
+    with os.scandir(path) as entries:
+        return {entry.name for entry in entries}
+
 def detect_app_type(path):
-    if os.path.exists(os.path.join(path, "package.json")):
-            return "nodejs"
-    elif os.path.exists(os.path.join(path, "requirements.txt")) or os.path.exists(os.path.join(path, "pyproject.toml")):
+    # One directory read instead of a stat per candidate file
+    names = list_names(path)
+
+    if "package.json" in names:
+        return "nodejs"
+    elif "requirements.txt" in names or "pyproject.toml" in names:
         return "python"
-    elif os.path.exists(os.path.join(path, "index.html")):
+    elif "index.html" in names:
         return "static"
     else:
         return "unknown"
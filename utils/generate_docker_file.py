@@ -1,32 +1,81 @@
 import os
+import hashlib
 from utils.call_ai import call_ai
+from utils.build_docker_image import exposed_port
+from utils.detect_app_type import list_names
+from utils.atomic_write import atomic_write
+
+DOCKERFILE_CACHE_DIR = os.environ.get("KUBEHOST_DOCKERFILE_CACHE", "dockerfile_cache")
+DOCKERFILE_MODEL = "llama-3.3-70b-versatile"
+
+# Static sites always get the same image, so there is nothing to ask the LLM
+_STATIC_DOCKERFILE = """FROM nginx:alpine
+COPY . /usr/share/nginx/html
+EXPOSE 80
+CMD ["nginx", "-g", "daemon off;"]
+"""
+# The whole checkout becomes the web root, so keep the repo metadata, build
+# files and the user's .env out of the image
+_STATIC_DOCKERIGNORE = """.git
+.env
+Dockerfile
+.dockerignore
+"""
+
+def write_cached_dockerfile(cache_path, content):
+    """Store a generated Dockerfile; atomic so a crash never leaves a partial hit"""
+    os.makedirs(DOCKERFILE_CACHE_DIR, exist_ok=True)
+    atomic_write(cache_path, content)
+
+async def generate_dockerfile(app_path, app_type):
+    """
+    Write app_path/Dockerfile and return (content, port, cache_path)
+
+    port is the EXPOSE port or None. cache_path is only set for a fresh LLM
+    generation: the caller stores the Dockerfile there with
+    write_cached_dockerfile once it has built, so a generation that doesn't
+    build is never cached and the next deploy asks the LLM again.
+    """
+    names = list_names(app_path)
 
-def generate_dockerfile(app_path, app_type):
     dockerfile_path = os.path.join(app_path, "Dockerfile")
-    if os.path.exists(dockerfile_path):
+    if "Dockerfile" in names:
         os.remove(dockerfile_path)
+
+    if app_type == "static":
+        print("Using static site Dockerfile")
+        with open(dockerfile_path, "w") as f:
+            f.write(_STATIC_DOCKERFILE)
+        # Append to the repo's own .dockerignore rather than replacing its
+        # rules; last match wins, so a "!.env" earlier in it can't re-include
+        dockerignore_path = os.path.join(app_path, ".dockerignore")
+        existing = ""
+        if ".dockerignore" in names:
+            with open(dockerignore_path, "r") as f:
+                existing = f.read()
+        if not existing.endswith(_STATIC_DOCKERIGNORE):
+            if existing and not existing.endswith("\n"):
+                existing += "\n"
+            with open(dockerignore_path, "w") as f:
+                f.write(existing + _STATIC_DOCKERIGNORE)
+        return _STATIC_DOCKERFILE, exposed_port(_STATIC_DOCKERFILE), None
     
     # Determine dependency file
     if app_type in ["nodejs"]:
         file_path = os.path.join(app_path, "package.json")
     elif app_type == "python":
-        file_path = os.path.join(app_path, "requirements.txt") if os.path.exists(os.path.join(app_path, "requirements.txt")) else os.path.join(app_path, "pyproject.toml")
-    elif app_type == "static":
-        file_path = None
+        file_path = os.path.join(app_path, "requirements.txt" if "requirements.txt" in names else "pyproject.toml")
     else:
         raise Exception("Unknown app type")
     
     # Read dependency file
-    if file_path:
-        with open(file_path, "r") as f:
-            content = f.read()
-    else:
-        content = "static html"
+    with open(file_path, "r") as f:
+        content = f.read()
     
     # Check for .env file and extract port information
     env_file_path = os.path.join(app_path, ".env")
     port_info = ""
-    if os.path.exists(env_file_path):
+    if ".env" in names:
         with open(env_file_path, "r") as env_file:
             env_lines = env_file.readlines()
             for line in env_lines:
@@ -40,10 +89,34 @@ def generate_dockerfile(app_path, app_type):
                         port_info += f"\n\nIMPORTANT: The user has set {key}={value} in their environment variables.le."
     
     # Generate multistage Dockerfile
-    system_prompt = "You are a Dockerfile expert. Generate ONLY a production-ready multistage Dockerfile. Return ONLY the Dockerfile content with no explanations, no markdown code blocks, no extra text."
-    messages = [{"role": "user", "content": f"Create a multistage Dockerfile for {app_type}:\n\n{content}{port_info}"}]
+    # Copying the dependency manifest before the source keeps the install layer
+    # cached by BuildKit when only application code changes
+    system_prompt = (
+        "You are a Dockerfile expert. Generate ONLY a production-ready multistage Dockerfile. "
+        "COPY the dependency manifest (package.json and its lockfile, or requirements.txt / pyproject.toml) "
+        "and install dependencies BEFORE copying the rest of the source with COPY . . "
+        "Return ONLY the Dockerfile content with no explanations, no markdown code blocks, no extra text."
+    )
+    user_prompt = f"Create a multistage Dockerfile for {app_type}:\n\n{content}{port_info}"
+    messages = [{"role": "user", "content": user_prompt}]
+
+    # Reuse a previous generation for the exact same request; the model and
+    # prompts are part of the key so editing either invalidates old entries
+    cache_key = hashlib.blake2b(
+        f"{DOCKERFILE_MODEL}\0{system_prompt}\0{user_prompt}".encode()
+    ).hexdigest()
+    cache_path = os.path.join(DOCKERFILE_CACHE_DIR, f"{cache_key}.Dockerfile")
+    if os.path.exists(cache_path):
+        print("Using cached Dockerfile")
+        with open(cache_path, "r") as f:
+            dockerfile_content = f.read()
+        with open(dockerfile_path, "w") as f:
+            f.write(dockerfile_content)
+        return dockerfile_content, exposed_port(dockerfile_content), None
     
-    dockerfile_content = call_ai(messages, system_prompt=system_prompt)
+    dockerfile_content = await call_ai(messages, model=DOCKERFILE_MODEL, system_prompt=system_prompt)
     
     with open(dockerfile_path, "w") as f:
         f.write(dockerfile_content)
+
+    return dockerfile_content, exposed_port(dockerfile_content), cache_path
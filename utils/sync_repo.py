@@ -0,0 +1,43 @@
+import asyncio
+import os
+import shutil
+import subprocess
+
+async def run_git(*args):
+    """Run a git command without blocking the event loop"""
+    proc = await asyncio.create_subprocess_exec("git", *args)
+    try:
+        returncode = await proc.wait()
+    except asyncio.CancelledError:
+        # Don't leave git writing into a checkout the next deploy will reuse
+        proc.kill()
+        await proc.wait()
+        raise
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, ["git", *args])
+
+async def sync_repo(git_url, branch, app_path):
+    """
+    Bring app_path to the tip of branch with as little transfer as possible
+
+    First deploy does a shallow, blobless single-branch clone. Redeploys keep
+    the existing checkout and only fetch the new tip, then reset and clean it
+    so no files from the previous deploy leak into the next build.
+    """
+    if os.path.isdir(os.path.join(app_path, ".git")):
+        try:
+            await run_git("-C", app_path, "remote", "set-url", "origin", git_url)
+            await run_git("-C", app_path, "fetch", "--depth", "1", "origin", branch)
+            await run_git("-C", app_path, "reset", "--hard", "FETCH_HEAD")
+            await run_git("-C", app_path, "clean", "-fdx")
+            return
+        except subprocess.CalledProcessError as e:
+            print(f"Warning: Incremental fetch failed, re-cloning: {e}")
+
+    if os.path.exists(app_path):
+        shutil.rmtree(app_path)
+
+    await run_git(
+        "clone", "--depth", "1", "--filter=blob:none", "--single-branch",
+        "-b", branch, git_url, app_path
+    )